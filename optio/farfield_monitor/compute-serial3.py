@@ -36,8 +36,25 @@ for period in periods:
                         filename += "{:1.4f}".format(params[param])
                         filename += "_"
 
-                    command = "mpirun -np {6} python gc_outcoupler2.py -period {0:} -FF {1:} -theta {2:} -x {3:} -source {4:} -filename {5:} > ./logs/{5:}.log".format(
-                        period, FF, theta, x, source, filename, num_processors
-                    )
+                    command = [
+                        "mpirun",
+                        "-np",
+                        str(num_processors),
+                        "python",
+                        "gc_outcoupler2.py",
+                        "-period",
+                        str(period),
+                        "-FF",
+                        str(FF),
+                        "-theta",
+                        str(theta),
+                        "-x",
+                        str(x),
+                        "-source",
+                        str(source),
+                        "-filename",
+                        filename,
+                    ]
 
-                    subprocess.call(command, shell=True)
+                    with open("./logs/{}.log".format(filename), "w") as log:
+                        subprocess.call(command, stdout=log)
@@ -2,8 +2,8 @@ import subprocess
 
 processes = []
 for index in range(1, 6):
-    command = "python compute-serial" + str(index) + ".py"
-    process = subprocess.Popen(command, shell=True)
+    command = ["python", "compute-serial" + str(index) + ".py"]
+    process = subprocess.Popen(command)
     processes.append(process)
 # Collect statuses
 output = [p.wait() for p in processes]
@@ -1,3 +1,4 @@
+import contextlib
 import numpy as np
 import subprocess
 from datetime import datetime
@@ -36,11 +37,26 @@ for period in periods:
                         filename += "{:1.4f}".format(params[param])
                         filename += "_"
 
-                    commands.append(
-                        "mpirun -np {6} python gc_outcoupler.py -period {0:} -FF {1:} -theta {2:} -x {3:} -source {4:} -filename {5:} > ./logs/{5:}.log".format(
-                            period, FF, theta, x, source, filename, num_processors
-                        )
-                    )
+                    command = [
+                        "mpirun",
+                        "-np",
+                        str(num_processors),
+                        "python",
+                        "gc_outcoupler.py",
+                        "-period",
+                        str(period),
+                        "-FF",
+                        str(FF),
+                        "-theta",
+                        str(theta),
+                        "-x",
+                        str(x),
+                        "-source",
+                        str(source),
+                        "-filename",
+                        filename,
+                    ]
+                    commands.append((command, "./logs/{}.log".format(filename)))
 
 # We have 60 cores, so stagger execution
 def chunks(l, n):
@@ -57,10 +73,13 @@ sims = (
 commands_chunks = chunks(commands, int(60 / num_processors))
 
 for commands_chunk in commands_chunks:
-    processes = []
-    for command in commands_chunk:
-        process = subprocess.Popen(command, shell=True)
-        processes.append(process)
-    # Collect statuses
-    output = [p.wait() for p in processes]
+    # Log files are closed even if a launch or wait fails
+    with contextlib.ExitStack() as stack:
+        processes = []
+        for command, log_path in commands_chunk:
+            log = stack.enter_context(open(log_path, "w"))
+            process = subprocess.Popen(command, stdout=log)
+            processes.append(process)
+        # Collect statuses
+        output = [p.wait() for p in processes]
     print(output)
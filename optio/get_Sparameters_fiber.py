@@ -9,22 +9,29 @@ MFD:
 
 import sys
 from functools import partial
-from typing import Optional, Tuple, Dict
+from typing import Callable, Optional, Tuple, Dict, List
 
 import hashlib
+import inspect
+import multiprocessing
+import queue
+import threading
 import time
 import pathlib
 import omegaconf
 import pandas as pd
 import subprocess
-import shlex
 import shutil
 
 import meep as mp
 import numpy as np
 import fire
 
-from optio.get_simulation_fiber import get_simulation_fiber
+from optio.get_simulation_fiber import (
+    get_cell_layout,
+    get_simulation_fiber,
+    to_string,
+)
 
 
 nm = 1e-3
@@ -33,27 +40,9 @@ nSiO2 = 1.44
 
 Floats = Tuple[float, ...]
 
-
-def dict_to_name(**kwargs) -> str:
-    """Returns name from a dict."""
-    kv = []
-
-    for key in sorted(kwargs):
-        if isinstance(key, str):
-            value = kwargs[key]
-            if value is not None:
-                kv += [f"{key}{to_string(value)}"]
-    return "_".join(kv)
-
-
-def to_string(value):
-    if isinstance(value, list):
-        settings_string_list = [to_string(i) for i in value]
-        return "_".join(settings_string_list)
-    if isinstance(value, dict):
-        return dict_to_name(**value)
-    else:
-        return str(value)
+# Part of the hashed settings: bump when a change makes stored results stale
+# 2: fiber port x offset and cell width follow the fiber port height
+RESULTS_VERSION = 2
 
 
 def fiber_ncore(fiber_numerical_aperture, fiber_nclad):
@@ -83,6 +72,7 @@ def get_Sparameters_simulation(
         {
             "decay_by": decay_by,
             "ncores": ncores,
+            "results_version": RESULTS_VERSION,
         }
     )
 
@@ -94,11 +84,11 @@ def get_Sparameters_simulation(
     dirpath = pathlib.Path(dirpath)
     dirpath.mkdir(exist_ok=True, parents=True)
     filepath = dirpath / filename
-    filepath_csv = filepath.with_suffix(".csv")
+    filepath_parquet = filepath.with_suffix(".parquet")
     filepath_mp4 = filepath.with_suffix(".mp4")
 
-    if filepath_csv.exists() and not overwrite:
-        return pd.read_csv(filepath_csv)
+    if filepath_parquet.exists() and not overwrite:
+        return pd.read_parquet(filepath_parquet)
     else:
         sim = sim_dict["sim"]
         freqs = sim_dict["freqs"]
@@ -196,8 +186,12 @@ def get_Sparameters_simulation(
         s.update({f"{key}m": list(np.abs(r[key].flatten())) for key in keys})
         s["wavelength"] = wavelengths
 
-        df = pd.DataFrame(s, index=wavelengths)
-        df.to_csv(filepath_csv, index=False)
+        # Swept settings as columns, so sweeps are read back without the yaml
+        df = pd.DataFrame(s, index=wavelengths).assign(
+            fiber_xposition=settings["fiber_xposition"],
+            fiber_angle_deg=settings["fiber_angle_deg"],
+        )
+        df.to_parquet(filepath_parquet, index=False, compression="zstd")
         return df
 
 
@@ -337,14 +331,14 @@ def write_sparameters_meep_parallel(
     script_file_obj.writelines(script_lines)
     script_file_obj.close()
 
-    # Exec string
-    command = f"mpirun -np {cores} python {script_file}"
+    # Exec arguments, passed without a shell
+    command = ["mpirun", "-np", str(cores), "python", str(script_file)]
 
     # Launch simulation
     if verbosity:
-        print(f"Launching: {command}")
+        print(f"Launching: {' '.join(command)}")
     proc = subprocess.Popen(
-        shlex.split(command),
+        command,
         shell=False,
         stdin=None,
         stdout=None,
@@ -354,35 +348,181 @@ def write_sparameters_meep_parallel(
     return proc
 
 
+def expected_runtime(instance: Dict, cores: int = 1) -> float:
+    """Returns a relative runtime estimate for an instance, used to launch the longest simulations first.
+
+    Scales as the number of pixels in the cell (res**2 * sxy * sz) over the number of cores.
+    """
+    parameters = inspect.signature(get_Sparameters_fiber).parameters
+    settings = {key: parameter.default for key, parameter in parameters.items()}
+    settings.update(instance)
+
+    layout_parameters = inspect.signature(get_cell_layout).parameters
+    layout = get_cell_layout(**{key: settings[key] for key in layout_parameters})
+    return settings["res"] ** 2 * layout["sxy"] * layout["sz"] / cores
+
+
+# Settings shared by all the instances of a pool, set once per worker
+_base_instance: Dict = {}
+
+
+def _init_pool_worker(base_instance: Dict) -> None:
+    """Pool initializer: receives the shared settings once per worker."""
+    global _base_instance
+    _base_instance = base_instance
+
+
+def _get_Sparameters_fiber_instance(task: Tuple[int, Dict]) -> Tuple[int, pd.DataFrame]:
+    """Pool task: runs get_Sparameters_fiber in the worker process."""
+    index, instance = task
+    return index, get_Sparameters_fiber(**{**_base_instance, **instance})
+
+
+def _consume_results(
+    results_queue: queue.Queue,
+    callback: Callable[[Dict, pd.DataFrame], None],
+    errors: List[Exception],
+) -> None:
+    """Consumer thread: calls callback on each (instance, df) until None is received.
+
+    Stops at the first exception raised by callback, stored in errors for the caller to re-raise.
+    """
+    while True:
+        result = results_queue.get()
+        if result is None:
+            return
+        try:
+            callback(*result)
+        except Exception as error:
+            errors.append(error)
+            return
+
+
+def write_sparameters_meep_pool(
+    instances: Tuple,
+    base_instance: Optional[Dict] = None,
+    total_cores: int = 4,
+    chunksize: int = 1,
+    callback: Optional[Callable[[Dict, pd.DataFrame], None]] = None,
+    verbosity: bool = False,
+) -> List[pd.DataFrame]:
+    """
+    Given a tuple of write_sparameters_meep keyword arguments (the "instances"), runs serial simulations on a persistent pool of workers
+    Each worker imports meep once and is reused for all the instances it receives, instead of paying the interpreter + meep import + MPI startup for every instance
+    Instances are dispatched longest first (see expected_runtime) and handed to workers as they free up, so short simulations fill the tail
+
+    Args
+        instances ([Dict]): list of Dicts. The keys must be parameters names of write_sparameters_meep, and entries the values
+        base_instance (Dict): settings shared by all instances, sent once to each worker instead of with every instance. Instances only need the values that differ
+        total_cores (int): number of worker processes
+        chunksize (int): number of instances sent to a worker at once
+        callback (Callable): called with (instance, df) as each simulation completes, on a consumer thread, to post-process while the others run
+        verbosity: progress messages
+
+    Returns
+        list of S-parameter DataFrames, in the order of instances
+    """
+    if not instances:
+        return []
+
+    processes = min(total_cores, len(instances))
+    if verbosity:
+        print(
+            f"Running {len(instances)} instances on a pool of {processes} workers"
+        )
+
+    base_instance = base_instance or {}
+    tasks = sorted(
+        enumerate(instances),
+        key=lambda task: -expected_runtime({**base_instance, **task[1]}),
+    )
+    results = [None] * len(instances)
+
+    # Slow callbacks (writing, aggregating) must not hold up collecting results
+    callback_errors = []
+    if callback:
+        results_queue = queue.Queue()
+        consumer = threading.Thread(
+            target=_consume_results, args=(results_queue, callback, callback_errors)
+        )
+        consumer.start()
+
+    # spawn: workers must not inherit an (MPI-)initialized meep from the driver
+    context = multiprocessing.get_context("spawn")
+    try:
+        with context.Pool(
+            processes=processes,
+            initializer=_init_pool_worker,
+            initargs=(base_instance,),
+        ) as pool:
+            for index, df in pool.imap_unordered(
+                _get_Sparameters_fiber_instance, tasks, chunksize=chunksize
+            ):
+                if verbosity:
+                    print(f"Instance {index} done")
+                results[index] = df
+                if callback and not callback_errors:
+                    results_queue.put(({**base_instance, **instances[index]}, df))
+    finally:
+        if callback:
+            results_queue.put(None)
+            consumer.join()
+
+    if callback_errors:
+        raise callback_errors[0]
+    return results
+
+
 def write_sparameters_meep_parallel_pools(
     instances: Tuple,
     cores_per_instance: int = 2,
     total_cores: int = 4,
     temp_dir: Optional[str] = None,
     delete_temp_files: bool = False,
+    base_instance: Optional[Dict] = None,
+    chunksize: int = 1,
+    callback: Optional[Callable[[Dict, pd.DataFrame], None]] = None,
     verbosity: bool = False,
 ):
     """
     Given a tuple of write_sparameters_meep keyword arguments (the "instances"), launches parallel simulations
     Each simulation is assigned "cores_per_instance" cores
-    A total of "total_cores" is assumed, if cores_per_instance * len(instances) > total_cores then the overflow will be performed serially
+    A total of "total_cores" is assumed, if cores_per_instance * len(instances) > total_cores then the overflow is launched as running simulations finish, longest first
+    With cores_per_instance = 1, the instances are run on a persistent pool of workers (see write_sparameters_meep_pool) rather than one mpirun each
 
     Args
         instances ([Dict]): list of Dicts. The keys must be parameters names of write_sparameters_meep, and entries the values
         cores_per_instance (int): number of processors to assign to each instance
         total_cores (int): total number of cores to use
-        temp_dir (FilePath): temporary directory to hold simulation files
-        delete_temp_file (Boolean): whether to delete temp_dir when done
+        temp_dir (FilePath): temporary directory to hold simulation files. Unused with cores_per_instance = 1, which writes no temporary files
+        delete_temp_file (Boolean): whether to delete temp_dir when done. Unused with cores_per_instance = 1
+        base_instance (Dict): settings shared by all instances. Instances only need the values that differ
+        chunksize (int): number of instances sent to a worker at once. Only used with cores_per_instance = 1
+        callback (Callable): called with (instance, df) as each simulation completes. Only used with cores_per_instance = 1
         verbosity: progress messages
     """
+    # Serial instances run in-process on a persistent pool, no mpirun needed
+    if cores_per_instance == 1:
+        write_sparameters_meep_pool(
+            instances=instances,
+            base_instance=base_instance,
+            total_cores=total_cores,
+            chunksize=chunksize,
+            callback=callback,
+            verbosity=verbosity,
+        )
+        return
+
+    if base_instance:
+        instances = [{**base_instance, **instance} for instance in instances]
+
     # Save the component object to simulation for later retrieval
     temp_dir = temp_dir or pathlib.Path(__file__).parent / "temp"
     temp_dir = pathlib.Path(temp_dir)
     temp_dir.mkdir(exist_ok=True, parents=True)
 
-    # Setup pools
-    num_pools = int(np.ceil(cores_per_instance * len(instances) / total_cores))
-    instances_per_pool = int(np.floor(total_cores / cores_per_instance))
+    # Setup slots
+    max_running = max(1, int(np.floor(total_cores / cores_per_instance)))
     num_tasks = len(instances)
 
     if verbosity:
@@ -390,39 +530,36 @@ def write_sparameters_meep_parallel_pools(
         print(
             f"Using a total of {total_cores} cores with {cores_per_instance} cores per instance"
         )
-        print(
-            f"Tasks split amongst {num_pools} pools with up to {instances_per_pool} instances each."
-        )
+        print(f"Up to {max_running} instances run at once.")
 
-    i = 0
-    # For each pool
-    for j in range(num_pools):
-        processes = []
-        # For instance in the pool
-        for k in range(instances_per_pool):
-            # Flag to catch nonfull pools
-            if i >= num_tasks:
-                continue
-            if verbosity:
-                print(f"Task {k} of pool {j} is instance {i}")
-            # Obtain current instance
-            instance = instances[i]
-
-            process = write_sparameters_meep_parallel(
-                instance=instance,
-                cores=cores_per_instance,
-                temp_dir=temp_dir,
-                temp_file_str=f"write_sparameters_meep_parallel_{i}",
-                verbosity=verbosity,
-            )
-            processes.append(process)
+    # Longest simulations first, so that short ones fill the tail
+    order = sorted(
+        range(num_tasks),
+        key=lambda i: -expected_runtime(instances[i], cores=cores_per_instance),
+    )
 
-            # Increment task number
-            i += 1
+    processes = []
+    for i in order:
+        # Wait for a free slot
+        while len(processes) >= max_running:
+            processes = [process for process in processes if process.poll() is None]
+            if len(processes) >= max_running:
+                time.sleep(1)
+
+        if verbosity:
+            print(f"Launching instance {i}")
+        process = write_sparameters_meep_parallel(
+            instance=instances[i],
+            cores=cores_per_instance,
+            temp_dir=temp_dir,
+            temp_file_str=f"write_sparameters_meep_parallel_{i}",
+            verbosity=verbosity,
+        )
+        processes.append(process)
 
-        # Wait for pool to end
-        for process in processes:
-            process.wait()
+    # Wait for the last simulations to end
+    for process in processes:
+        process.wait()
 
     if delete_temp_files:
         shutil.rmtree(temp_dir)
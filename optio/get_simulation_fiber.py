@@ -12,23 +12,14 @@ TODO:
 
 """
 
-import sys
-from functools import partial
+from functools import lru_cache
 from typing import Any, Dict, Optional, Tuple
 
-import hashlib
-import time
-import pathlib
-import omegaconf
-import pandas as pd
-import pydantic
+import struct
 
 import meep as mp
 import numpy as np
-import fire
-
-# from gdsfactory.simulation.modes import Mode
-from gdsfactory.simulation.modes.types import *
+import xxhash
 
 # from optio.visualization import plotStructure_fromSimulation
 
@@ -42,32 +33,160 @@ nSiO2 = 1.44
 Floats = Tuple[float, ...]
 
 
-def dict_to_name(**kwargs) -> str:
-    """Returns name from a dict."""
-    kv = []
+@lru_cache(maxsize=64)
+def _sorted_keys(keys: Tuple[Any, ...]) -> Tuple[str, ...]:
+    """Returns the string keys, sorted once per distinct key set."""
+    return tuple(sorted(key for key in keys if isinstance(key, str)))
 
-    for key in sorted(kwargs):
-        if isinstance(key, str):
-            value = kwargs[key]
-            if value is not None:
-                kv += [f"{key}{to_string(value)}"]
+
+def _dict_to_name(settings: Dict[str, Any]) -> str:
+    kv = []
+    for key in _sorted_keys(tuple(settings)):
+        value = settings[key]
+        if value is not None:
+            kv.append(key + to_string(value))
     return "_".join(kv)
 
 
-def to_string(value):
+def _list_to_string(value: list) -> str:
+    try:
+        # Lists of floats (widths, gaps) are formatted without recursing
+        return "_".join(map(float.__repr__, value))
+    except TypeError:
+        return "_".join([to_string(i) for i in value])
+
+
+def dict_to_name(**kwargs) -> str:
+    """Returns name from a dict."""
+    return _dict_to_name(kwargs)
+
+
+def to_string(value) -> str:
+    """Returns value as a string, joining list items with _."""
+    if type(value) is float:
+        return float.__repr__(value)
     if isinstance(value, list):
-        settings_string_list = [to_string(i) for i in value]
-        return "_".join(settings_string_list)
+        return _list_to_string(value)
     if isinstance(value, dict):
-        return dict_to_name(**value)
-    else:
-        return str(value)
+        return _dict_to_name(value)
+    return str(value)
+
+
+@lru_cache(maxsize=64)
+def get_medium(index: float) -> mp.Medium:
+    """Returns a shared, non-dispersive medium for an index.
+
+    The medium is reused across calls, do not modify it.
+    """
+    return mp.Medium(index=index)
+
+
+@lru_cache(maxsize=8)
+def get_wavelengths_freqs(
+    wavelength_min: float, wavelength_max: float, wavelength_points: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the (wavelengths, freqs) grid, shared across calls.
+
+    The arrays are read-only since the same instances are returned to every caller.
+    """
+    wavelengths = np.linspace(wavelength_min, wavelength_max, wavelength_points)
+    freqs = 1 / wavelengths
+    wavelengths.flags.writeable = False
+    freqs.flags.writeable = False
+    return wavelengths, freqs
+
+
+def get_settings_hash(settings: Dict[str, Any]) -> str:
+    """Returns the full xxh64 hash (16 hex characters) of the settings.
+
+    Each key is hashed with its value, in sorted key order. Scalars are
+    packed as doubles (None as nan) and lists hashed from their length and
+    float64 bytes, so no value is converted to a string.
+    """
+    h = xxhash.xxh64()
+    for key in sorted(settings):
+        value = settings[key]
+        h.update(key.encode() + b"\0")
+        if isinstance(value, (list, tuple, np.ndarray)):
+            array = np.asarray(value, dtype=float)
+            h.update(struct.pack("=q", array.size))
+            h.update(array.tobytes())
+        else:
+            h.update(struct.pack("=d", np.nan if value is None else value))
+    return h.hexdigest()
 
 
 def fiber_ncore(fiber_numerical_aperture, fiber_nclad):
     return (fiber_numerical_aperture ** 2 + fiber_nclad ** 2) ** 0.5
 
 
+def get_cell_layout(
+    fiber_angle_deg: float,
+    fiber_core_diameter: float,
+    pml_thickness: float,
+    substrate_thickness: float,
+    bottom_clad_thickness: float,
+    core_thickness: float,
+    top_clad_thickness: float,
+    air_gap_thickness: float,
+    fiber_thickness: float,
+    fiber_port_y_offset_from_air: float,
+) -> Dict[str, float]:
+    """Returns the cell size (sxy, sz) and the y coordinates of the stack and ports.
+
+    Shared by get_simulation_fiber and the sweep runtime estimate.
+    """
+    fiber_angle = np.radians(fiber_angle_deg)
+
+    # Z (Y)-domain
+    sz = (
+        +pml_thickness
+        + substrate_thickness
+        + bottom_clad_thickness
+        + core_thickness
+        + top_clad_thickness
+        + air_gap_thickness
+        + fiber_thickness
+        + pml_thickness
+    )
+    # Y coordinates of the stack interfaces, bottom to top
+    y0 = -sz / 2
+    y_substrate_top = y0 + pml_thickness + substrate_thickness
+    y_core_bottom = y_substrate_top + bottom_clad_thickness
+    y_core_top = y_core_bottom + core_thickness
+    y_clad_top = y_core_top + top_clad_thickness
+
+    # Port heights
+    fiber_port_y = y_clad_top + air_gap_thickness + fiber_port_y_offset_from_air
+    waveguide_port_y = (
+        y_substrate_top
+        + (bottom_clad_thickness + core_thickness + top_clad_thickness) / 2
+    )
+
+    # XY (X)-domain
+    # Assume fiber port dominates. The fiber axis goes through the origin, so
+    # at the port height it is offset by fiber_port_y * tan(fiber_angle).
+    fiber_port_x_offset_from_angle = np.abs(fiber_port_y * np.tan(fiber_angle))
+    sxy = (
+        3.5 * fiber_core_diameter
+        + 2 * pml_thickness
+        + 2 * fiber_port_x_offset_from_angle
+    )
+
+    return dict(
+        sxy=sxy,
+        sz=sz,
+        y0=y0,
+        y_substrate_top=y_substrate_top,
+        y_core_bottom=y_core_bottom,
+        y_core_top=y_core_top,
+        y_clad_top=y_clad_top,
+        fiber_port_y=fiber_port_y,
+        waveguide_port_y=waveguide_port_y,
+        fiber_port_x_offset_from_angle=fiber_port_x_offset_from_angle,
+    )
+
+
 def get_simulation_fiber(
     # grating parameters
     period: float = 0.66,
@@ -113,9 +232,10 @@ def get_simulation_fiber(
     Args:
         TODO
     """
-    wavelengths = np.linspace(wavelength_min, wavelength_max, wavelength_points)
+    wavelengths, freqs = get_wavelengths_freqs(
+        wavelength_min, wavelength_max, wavelength_points
+    )
     wavelength = np.mean(wavelengths)
-    freqs = 1 / wavelengths
     widths = widths or n_periods * [period * fill_factor]
     gaps = gaps or n_periods * [period * (1 - fill_factor)]
 
@@ -149,48 +269,46 @@ def get_simulation_fiber(
         waveguide_port_x_offset_from_grating_start=waveguide_port_x_offset_from_grating_start,
         fiber_port_x_size=fiber_port_x_size,
     )
-    settings_string = to_string(settings)
-    settings_hash = hashlib.md5(settings_string.encode()).hexdigest()[:8]
+    settings_hash = get_settings_hash(settings)
 
     # Angle in radians
     fiber_angle = np.radians(fiber_angle_deg)
+    # Fiber axes, rotated once for the port and both fiber blocks
+    fiber_e1 = mp.Vector3(x=1).rotate(mp.Vector3(z=1), -1 * fiber_angle)
+    fiber_e2 = mp.Vector3(y=1).rotate(mp.Vector3(z=1), -1 * fiber_angle)
 
-    # Z (Y)-domain
-    sz = (
-        +pml_thickness
-        + substrate_thickness
-        + bottom_clad_thickness
-        + core_thickness
-        + top_clad_thickness
-        + air_gap_thickness
-        + fiber_thickness
-        + pml_thickness
-    )
-    # XY (X)-domain
-    # Assume fiber port dominates
-    fiber_port_y = (
-        -sz / 2
-        + core_thickness
-        + top_clad_thickness
-        + air_gap_thickness
-        + fiber_port_y_offset_from_air
-    )
-    fiber_port_x_offset_from_angle = np.abs(fiber_port_y * np.tan(fiber_angle))
-    sxy = (
-        3.5 * fiber_core_diameter
-        + 2 * pml_thickness
-        + 2 * fiber_port_x_offset_from_angle
+    layout = get_cell_layout(
+        fiber_angle_deg=fiber_angle_deg,
+        fiber_core_diameter=fiber_core_diameter,
+        pml_thickness=pml_thickness,
+        substrate_thickness=substrate_thickness,
+        bottom_clad_thickness=bottom_clad_thickness,
+        core_thickness=core_thickness,
+        top_clad_thickness=top_clad_thickness,
+        air_gap_thickness=air_gap_thickness,
+        fiber_thickness=fiber_thickness,
+        fiber_port_y_offset_from_air=fiber_port_y_offset_from_air,
     )
+    sxy = layout["sxy"]
+    sz = layout["sz"]
+    y0 = layout["y0"]
+    y_substrate_top = layout["y_substrate_top"]
+    y_core_bottom = layout["y_core_bottom"]
+    y_core_top = layout["y_core_top"]
+    y_clad_top = layout["y_clad_top"]
+    fiber_port_y = layout["fiber_port_y"]
+    waveguide_port_y = layout["waveguide_port_y"]
+    fiber_port_x_offset_from_angle = layout["fiber_port_x_offset_from_angle"]
 
     # length_grating = np.sum(widths) + np.sum(gaps)
 
     # Materials from indices
-    core_material = mp.Medium(index=ncore)
-    top_clad_material = mp.Medium(index=ncladtop)
-    bottom_clad_material = mp.Medium(index=ncladbottom)
+    core_material = get_medium(ncore)
+    top_clad_material = get_medium(ncladtop)
+    bottom_clad_material = get_medium(ncladbottom)
     fiber_ncore = (fiber_numerical_aperture ** 2 + fiber_nclad ** 2) ** 0.5
-    fiber_clad_material = mp.Medium(index=fiber_nclad)
-    fiber_core_material = mp.Medium(index=fiber_ncore)
+    fiber_clad_material = get_medium(fiber_nclad)
+    fiber_core_material = get_medium(fiber_ncore)
 
     # Useful reference point
     grating_start = (
@@ -201,27 +319,11 @@ def get_simulation_fiber(
     cell_size = mp.Vector3(sxy, sz)
 
     # Ports (position, sizes, directions)
-    fiber_port_y = -sz / 2 + (
-        +pml_thickness
-        + substrate_thickness
-        + bottom_clad_thickness
-        + core_thickness
-        + top_clad_thickness
-        + air_gap_thickness
-        + fiber_port_y_offset_from_air
-    )
     fiber_port_center = mp.Vector3(fiber_port_x_offset_from_angle, fiber_port_y)
     fiber_port_x_size =  fiber_port_x_size or 3.5 * fiber_core_diameter
     fiber_port_size = mp.Vector3(fiber_port_x_size, 0, 0)
-    fiber_port_direction = mp.Vector3(y=-1).rotate(mp.Vector3(z=1), -1 * fiber_angle)
+    fiber_port_direction = fiber_e2.scale(-1)
 
-    waveguide_port_y = -sz / 2 + (
-        +pml_thickness
-        + substrate_thickness
-        + bottom_clad_thickness / 2
-        + core_thickness / 2
-        + top_clad_thickness / 2
-    )
     waveguide_port_x = grating_start - waveguide_port_x_offset_from_grating_start
     waveguide_port_center = mp.Vector3(
         waveguide_port_x, waveguide_port_y
@@ -242,8 +344,8 @@ def get_simulation_fiber(
             material=fiber_clad_material,
             center=mp.Vector3(0, waveguide_port_y - core_thickness / 2),
             size=mp.Vector3(fiber_clad, hfiber_geom),
-            e1=mp.Vector3(x=1).rotate(mp.Vector3(z=1), -1 * fiber_angle),
-            e2=mp.Vector3(y=1).rotate(mp.Vector3(z=1), -1 * fiber_angle),
+            e1=fiber_e1,
+            e2=fiber_e2,
         )
     )
     geometry.append(
@@ -251,8 +353,8 @@ def get_simulation_fiber(
             material=fiber_core_material,
             center=mp.Vector3(x=0),
             size=mp.Vector3(fiber_core_diameter, hfiber_geom),
-            e1=mp.Vector3(x=1).rotate(mp.Vector3(z=1), -1 * fiber_angle),
-            e2=mp.Vector3(y=1).rotate(mp.Vector3(z=1), -1 * fiber_angle),
+            e1=fiber_e1,
+            e2=fiber_e2,
         )
     )
 
@@ -260,18 +362,7 @@ def get_simulation_fiber(
     geometry.append(
         mp.Block(
             material=mp.air,
-            center=mp.Vector3(
-                0,
-                -sz / 2
-                + (
-                    +pml_thickness
-                    + substrate_thickness
-                    + bottom_clad_thickness
-                    + core_thickness
-                    + top_clad_thickness
-                    + air_gap_thickness / 2
-                ),
-            ),
+            center=mp.Vector3(0, y_clad_top + air_gap_thickness / 2),
             size=mp.Vector3(mp.inf, air_gap_thickness),
         )
     )
@@ -280,15 +371,7 @@ def get_simulation_fiber(
         mp.Block(
             material=top_clad_material,
             center=mp.Vector3(
-                0,
-                -sz / 2
-                + (
-                    +pml_thickness
-                    + substrate_thickness
-                    + bottom_clad_thickness
-                    + core_thickness / 2
-                    + top_clad_thickness / 2
-                ),
+                0, y_core_bottom + (core_thickness + top_clad_thickness) / 2
             ),
             size=mp.Vector3(mp.inf, core_thickness + top_clad_thickness),
         )
@@ -297,11 +380,7 @@ def get_simulation_fiber(
     geometry.append(
         mp.Block(
             material=bottom_clad_material,
-            center=mp.Vector3(
-                0,
-                -sz / 2
-                + (+pml_thickness + substrate_thickness + bottom_clad_thickness / 2),
-            ),
+            center=mp.Vector3(0, y_substrate_top + bottom_clad_thickness / 2),
             size=mp.Vector3(mp.inf, bottom_clad_thickness),
         )
     )
@@ -310,47 +389,32 @@ def get_simulation_fiber(
     geometry.append(
         mp.Block(
             material=core_material,
-            center=mp.Vector3(
-                0,
-                -sz / 2
-                + (
-                    +pml_thickness
-                    + substrate_thickness
-                    + bottom_clad_thickness
-                    + core_thickness / 2
-                ),
-            ),
+            center=mp.Vector3(0, y_core_bottom + core_thickness / 2),
             size=mp.Vector3(mp.inf, core_thickness),
         )
     )
 
     # grating etch
-    x = grating_start
-    for width, gap in zip(widths, gaps):
-        geometry.append(
-            mp.Block(
-                material=top_clad_material,
-                center=mp.Vector3(
-                    x + gap / 2,
-                    -sz / 2
-                    + (
-                        +pml_thickness
-                        + substrate_thickness
-                        + bottom_clad_thickness
-                        + core_thickness
-                        - etch_depth / 2
-                    ),
-                ),
-                size=mp.Vector3(gap, etch_depth),
-            )
+    y_etch = y_core_top - etch_depth / 2
+    n_etches = min(len(widths), len(gaps))
+    widths_array = np.asarray(widths[:n_etches], dtype=float)
+    gaps_array = np.asarray(gaps[:n_etches], dtype=float)
+    periods_start = np.cumsum(np.r_[0, (widths_array + gaps_array)[:-1]])
+    x_centers = grating_start + periods_start + gaps_array / 2
+    geometry.extend(
+        mp.Block(
+            material=top_clad_material,
+            center=mp.Vector3(x_center, y_etch),
+            size=mp.Vector3(gap, etch_depth),
         )
-        x += width + gap
+        for x_center, gap in zip(x_centers, gaps_array)
+    )
 
     # Substrate
     geometry.append(
         mp.Block(
-            material=mp.Medium(index=nsubstrate),
-            center=mp.Vector3(0, -sz / 2 + pml_thickness / 2 + substrate_thickness / 2),
+            material=get_medium(nsubstrate),
+            center=mp.Vector3(0, y0 + (pml_thickness + substrate_thickness) / 2),
             size=mp.Vector3(mp.inf, pml_thickness + substrate_thickness),
         )
     )
@@ -503,7 +567,6 @@ def plot(sim, eps_parameters=None):
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
-    import inspect
 
     # results = {}
     # for angle in [10]:  # np.linspace(0,360,72):
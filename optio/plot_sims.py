@@ -1,27 +1,64 @@
 import pathlib
+from typing import Iterable, Iterator, List, Optional, Tuple
+
 import pandas as pd
-from omegaconf import OmegaConf
+import yaml
 import matplotlib.pyplot as plt
 import numpy as np
 
+# libyaml loader when available, only plain dicts are needed here
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-def plot_fiber_xposition_max_power():
-    dirpath = pathlib.Path(__file__).parent / "data"
+# Settings stored as columns of the result files
+SWEPT_COLUMNS = ("fiber_xposition", "fiber_angle_deg")
 
-    fiber_xpositions = []
-    s21_max = []
+
+def _read_results(dirpath: pathlib.Path, columns: List[str]) -> Iterator[pd.DataFrame]:
+    """Yields the requested columns of each result file in dirpath, one file at a time.
+
+    CSV results from before the Parquet storage are read too, unless a Parquet
+    file with the same name exists, with the swept settings taken from their yaml.
+    """
+    for filepath in dirpath.glob("*.parquet"):
+        yield pd.read_parquet(filepath, columns=columns)
 
     for filepath_csv in dirpath.glob("*.csv"):
+        if filepath_csv.with_suffix(".parquet").exists():
+            continue
         filepath_yaml = filepath_csv.with_suffix(".yml")
-        settings = OmegaConf.load(filepath_yaml)
-        df = pd.read_csv(filepath_csv)
-        s21 = 10 * np.log10(df.s21m)
+        settings = yaml.load(filepath_yaml.read_text(), Loader=YamlLoader)
+        swept = {
+            column: settings["settings"][column]
+            for column in columns
+            if column in SWEPT_COLUMNS
+        }
+        df = pd.read_csv(
+            filepath_csv, usecols=[column for column in columns if column not in swept]
+        )
+        yield df.assign(**swept)[columns]
 
-        fiber_xposition = settings.settings.fiber_xposition
-        fiber_xpositions.append(fiber_xposition)
-        s21_max.append(max(s21))
 
-    plt.plot(fiber_xpositions, s21_max, ".")
+def _iter_sweep(results: Iterable[pd.DataFrame]) -> Iterator[Tuple[float, np.ndarray]]:
+    """Yields (fiber_xposition, s21m) for each S-parameter DataFrame of a sweep."""
+    for df in results:
+        yield df.fiber_xposition.iloc[0], df.s21m.values
+
+
+def _iter_results(dirpath: pathlib.Path) -> Iterator[Tuple[float, np.ndarray]]:
+    """Yields (fiber_xposition, s21m) for each simulation in dirpath, one file at a time."""
+    return _iter_sweep(_read_results(dirpath, ["fiber_xposition", "s21m"]))
+
+
+def plot_fiber_xposition_max_power(dirpath: Optional[pathlib.Path] = None):
+    dirpath = pathlib.Path(dirpath or pathlib.Path(__file__).parent / "data")
+
+    columns = ["fiber_xposition", "s21m"]
+    dfs = list(_read_results(dirpath, columns))
+    df = pd.concat(dfs) if dfs else pd.DataFrame(columns=columns, dtype=float)
+    # log10 is monotonic: take the max first, then convert only the maxima to dB
+    s21_max = 10 * np.log10(df.groupby("fiber_xposition").s21m.max())
+
+    plt.plot(s21_max.index, s21_max.values, ".")
     plt.xlabel("fiber_xposition")
     plt.ylabel("max S21 (dB)")
     plt.show()
@@ -31,22 +68,25 @@ def plot_fiber_xposition_spectrum(
     wavelength_min: float = 1.5,
     wavelength_max: float = 1.6,
     wavelength_points: int = 50,
+    results: Optional[Iterable[pd.DataFrame]] = None,
 ):
+    """Plots S21 spectra for each fiber_xposition.
+
+    Args:
+        results: S-parameter DataFrames, e.g. as collected by write_sparameters_meep_pool. Read from data/ when None.
+    """
     dirpath = pathlib.Path(__file__).parent / "data"
 
     fiber_xpositions = []
     s21_max = []
     wavelengths = np.linspace(wavelength_min, wavelength_max, wavelength_points)
 
-    for filepath_csv in dirpath.glob("*.csv"):
-        filepath_yaml = filepath_csv.with_suffix(".yml")
-        settings = OmegaConf.load(filepath_yaml)
-        df = pd.read_csv(filepath_csv)
-        s21 = 10 * np.log10(df.s21m)
+    sweep = _iter_results(dirpath) if results is None else _iter_sweep(results)
+    for fiber_xposition, s21m in sweep:
+        s21 = 10 * np.log10(s21m)
 
-        fiber_xposition = settings.settings.fiber_xposition
         fiber_xpositions.append(fiber_xposition)
-        s21_max.append(max(s21))
+        s21_max.append(s21.max())
         plt.plot(wavelengths, s21, label=str(fiber_xposition))
 
     plt.xlabel("wavelength")
@@ -58,13 +98,10 @@ def plot_fiber_xposition_spectrum(
 def plot_fiber_angle_deg():
     dirpath = pathlib.Path(__file__).parent / "data" / "fiber_sweep_angle_deg"
 
-    for filepath_csv in dirpath.glob("*.csv"):
-        filepath_yaml = filepath_csv.with_suffix(".yml")
-        settings = OmegaConf.load(filepath_yaml)
-        df = pd.read_csv(filepath_csv)
+    for df in _read_results(dirpath, ["fiber_angle_deg", "wavelength", "s21m"]):
         s21 = 10 * np.log10(df.s21m)
 
-        fiber_angle_deg = settings.settings.fiber_angle_deg
+        fiber_angle_deg = df.fiber_angle_deg.iloc[0]
         plt.plot(df.wavelength, s21, label=str(fiber_angle_deg))
 
     plt.xlabel("wavelength (um)")
@@ -80,10 +117,9 @@ def plot_ncores():
     ncores = []
     time = []
 
-    for filepath_csv in dirpath.glob("*.csv"):
-        filepath_yaml = filepath_csv.with_suffix(".yml")
-        settings = OmegaConf.load(filepath_yaml)
-        function_settings = settings.settings
+    for filepath_yaml in dirpath.glob("*.yml"):
+        settings = yaml.load(filepath_yaml.read_text(), Loader=YamlLoader)
+        function_settings = settings["settings"]
         if "ncores" in function_settings:
             ncores.append(function_settings["ncores"])
             time.append(settings["compute_time_seconds"])
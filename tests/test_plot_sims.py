@@ -0,0 +1,34 @@
+import pandas as pd
+import yaml
+import matplotlib.pyplot as plt
+
+from optio.plot_sims import _read_results, plot_fiber_xposition_max_power
+
+
+def test_read_results(tmp_path):
+    pd.DataFrame(
+        dict(wavelength=[1.5, 1.6], s21m=[0.1, 0.2], fiber_xposition=[1.0, 1.0])
+    ).to_parquet(tmp_path / "fiber_a.parquet", index=False)
+    # CSV with a Parquet sibling: skipped
+    pd.DataFrame(dict(wavelength=[1.5], s21m=[9.0])).to_csv(
+        tmp_path / "fiber_a.csv", index=False
+    )
+    # CSV without one: read, with fiber_xposition taken from its yaml
+    pd.DataFrame(dict(wavelength=[1.5, 1.6], s21m=[0.3, 0.4])).to_csv(
+        tmp_path / "fiber_b.csv", index=False
+    )
+    (tmp_path / "fiber_b.yml").write_text(
+        yaml.dump(dict(settings=dict(fiber_xposition=2.0, fiber_angle_deg=15.0)))
+    )
+
+    dfs = list(_read_results(tmp_path, ["fiber_xposition", "s21m"]))
+    assert [list(df.columns) for df in dfs] == 2 * [["fiber_xposition", "s21m"]]
+
+    df = pd.concat(dfs).sort_values("s21m")
+    assert df.fiber_xposition.tolist() == [1.0, 1.0, 2.0, 2.0]
+    assert df.s21m.tolist() == [0.1, 0.2, 0.3, 0.4]
+
+
+def test_plot_fiber_xposition_max_power_empty(tmp_path, monkeypatch):
+    monkeypatch.setattr(plt, "show", lambda: None)
+    plot_fiber_xposition_max_power(dirpath=tmp_path)
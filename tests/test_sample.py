@@ -2,7 +2,11 @@
 
 import numpy as np
 import matplotlib.pyplot as plt
-from optio.get_simulation_fiber import get_simulation_fiber 
+from optio.get_simulation_fiber import (
+    get_settings_hash,
+    get_simulation_fiber,
+    to_string,
+)
 from optio.get_Sparameters_fiber import get_Sparameters_fiber 
 
 
@@ -11,6 +15,22 @@ nm = 1e-3
 def test_pass():
     assert True, "dummy sample test"
 
+def test_to_string():
+    settings = dict(widths=[0.33, 0.33], n_periods=2, fiber_port_x_size=None)
+    assert to_string(settings) == "n_periods2_widths0.33_0.33"
+
+def test_get_settings_hash():
+    settings = dict(widths=[0.33, 0.33], n_periods=2, fiber_port_x_size=None)
+    settings_hash = get_settings_hash(settings)
+    assert settings_hash == get_settings_hash(dict(settings))
+    assert len(settings_hash) == 16
+    int(settings_hash, 16)
+    assert settings_hash == get_settings_hash(dict(reversed(settings.items())))
+    assert get_settings_hash(dict(widths=[0.33, 0.33])) != get_settings_hash(
+        dict(widths=[0.33], widths2=0.33)
+    )
+    assert settings_hash != get_settings_hash(dict(settings, fiber_port_x_size=0))
+
 def fiber_ncore(fiber_numerical_aperture, fiber_nclad):
     return (fiber_numerical_aperture ** 2 + fiber_nclad ** 2) ** 0.5
 